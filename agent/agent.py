@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import os
+import sys
 import asyncio
 import json
 from dotenv import load_dotenv
@@ -7,97 +8,267 @@ from langchain_anthropic import ChatAnthropic
 from langchain.tools import BaseTool
 from langchain.agents import AgentExecutor, create_tool_calling_agent
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.messages import SystemMessage
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from pydantic_core import to_jsonable_python
 from typing import Optional, Dict, Any
+from functools import lru_cache
 import logging
 
+try:
+    import orjson
+
+    def json_loads(data):
+        return orjson.loads(data)
+
+    def json_dump_bytes(obj) -> bytes:
+        return orjson.dumps(obj)
+except ImportError:
+    # Deployments without the C extension fall back to stdlib
+    json_loads = json.loads
+
+    def json_dump_bytes(obj) -> bytes:
+        return json.dumps(obj).encode()
+
 logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 load_dotenv()
 
+# Read once at import, right after load_dotenv; connection setup should
+# not go back to the environment
+_ANTHROPIC_KEY = os.getenv("ANTHROPIC_API_KEY")
+
+# Interned method names let dict lookups and comparisons take the
+# pointer-equality fast path on every MCP dispatch
+_TOOLS_CALL = sys.intern("tools/call")
+_TOOLS_LIST = sys.intern("tools/list")
+
+# Tool names containing these verbs have side effects (COMMAND tools), so
+# agent responses produced while they are available must not be replayed
+_COMMAND_VERBS = ("send", "submit", "click", "fill", "write", "set", "post", "put", "delete", "update", "create")
+_INFORMATIONAL_VERBS = ("get", "read", "list", "fetch", "search", "query", "describe")
+
+_RESPONSE_CACHE_MAX = 128
+
+# Scalar types orjson/json serialize directly; containers are excluded
+# since they may hold generated Pydantic model instances (e.g. an
+# array-of-objects tool argument) and need the full traversal
+_JSON_SCALAR_TYPES = (str, int, float, bool, type(None))
+
+# Back-pressure limits for MCP requests to a single browser
+_MCP_MAX_INFLIGHT = 64
+_MCP_BACKLOG_LIMIT = 1024
+
+
+def chunk_text(chunk) -> str:
+    """Extract the text portion of a streamed chat-model chunk"""
+    content = chunk.content
+    if isinstance(content, str):
+        return content
+    return "".join(
+        block.get("text", "")
+        for block in content
+        if isinstance(block, dict) and block.get("type") in ("text", "text_delta")
+    )
+
+
+def tools_are_cacheable(tools: list) -> bool:
+    """True when every tool is read-only, so agent replies can be cached"""
+    for tool in tools:
+        name = tool.name.lower()
+        if any(verb in name for verb in _COMMAND_VERBS):
+            return False
+        if not any(verb in name for verb in _INFORMATIONAL_VERBS):
+            # Unknown verbs are treated as commands to stay safe
+            return False
+    return True
+
 class ConnectionManager:
     """Manages a single WebSocket connection and its associated agent"""
-    
+
+    # Serialized request prefixes per MCP method, shared across connections
+    _method_prefixes: Dict[str, bytes] = {}
+
     def __init__(self, websocket: WebSocket):
         self.websocket = websocket
         self.mcp_request_id = 0
         self.pending_mcp_requests: Dict[int, asyncio.Future] = {}
         self.agent_executor: Optional[AgentExecutor] = None
         self.listener_task: Optional[asyncio.Task] = None
+        self.relay_task: Optional[asyncio.Task] = None
+        self.agent_worker_task: Optional[asyncio.Task] = None
+        self.init_task: Optional[asyncio.Task] = None
+        self.agent_ready = asyncio.Event()
+        self.out_queue: asyncio.Queue = asyncio.Queue()
+        self.in_queue: asyncio.Queue = asyncio.Queue()
+        self._inflight = asyncio.Semaphore(_MCP_MAX_INFLIGHT)
+        self._inflight_waiters = 0
+        self.cache_responses = False
+        self.response_cache: Dict[str, str] = {}
 
     async def listen(self):
         """Listens for incoming messages and handles them"""
         try:
             while True:
-                data = await self.websocket.receive_text()
+                frame = await self.websocket.receive()
+                if frame["type"] == "websocket.disconnect":
+                    raise WebSocketDisconnect(frame.get("code", 1000))
+                data = frame["bytes"] if frame.get("bytes") is not None else frame["text"]
                 try:
-                    message_data = json.loads(data)
-                    if "jsonrpc" in message_data and "method" not in message_data:
+                    message_data = json_loads(data)
+                    # MCP responses carry an "id", user frames a "message";
+                    # check the response case first since it dominates
+                    # during a tool-calling loop
+                    if "id" in message_data:
                         await self.handle_mcp_response(message_data)
-                    else:
-                        message = message_data.get("message", "")
-                        message_id = message_data.get("messageId")
-                        if message:
-                            asyncio.create_task(self.process_agent_message(message, message_id))
-
-                except json.JSONDecodeError:
-                    logging.error("Invalid JSON format received")
+                    elif (message := message_data.get("message")):
+                        self.in_queue.put_nowait((message, message_data.get("messageId")))
+
+                except ValueError:
+                    logger.error("Invalid JSON format received")
                 except Exception as e:
-                    logging.error(f"Error processing message: {e}")
+                    logger.error("Error processing message: %s", e)
 
         except WebSocketDisconnect:
-            logging.info("WebSocket disconnected.")
+            logger.info("WebSocket disconnected.")
         except Exception as e:
-            logging.error(f"Exception in listener task: {e}")
+            logger.error("Exception in listener task: %s", e)
         finally:
             self.cleanup()
 
+    async def relay(self):
+        """Drains the outbound queue, merging bursts into a single frame"""
+        try:
+            while True:
+                frame = await self.out_queue.get()
+                batch = [frame]
+                while not self.out_queue.empty() and len(batch) < 32:
+                    batch.append(self.out_queue.get_nowait())
+                await self.websocket.send_bytes(b"\n".join(batch))
+        except WebSocketDisconnect:
+            logger.info("WebSocket disconnected.")
+        except Exception as e:
+            logger.error("Exception in relay task: %s", e)
+
+    async def _init_agent(self):
+        """Discovers tools and builds the agent, then releases the worker"""
+        try:
+            tools = await discover_and_create_tools(self)
+            if tools:
+                self.agent_executor = await create_agent_with_tools(tools)
+            else:
+                self.agent_executor = await get_no_tool_executor()
+            self.cache_responses = tools_are_cacheable(tools)
+        except Exception as e:
+            logger.error("Error initializing agent: %s", e)
+        finally:
+            self.agent_ready.set()
+
+    async def agent_worker(self):
+        """Processes queued user messages one at a time"""
+        # Messages arriving during discovery buffer in in_queue until the
+        # agent is built
+        await self.agent_ready.wait()
+        while True:
+            message, message_id = await self.in_queue.get()
+            await self.process_agent_message(message, message_id)
+
+    def send_json(self, obj: dict):
+        """Queues a JSON message for the relay task to send"""
+        self.out_queue.put_nowait(json_dump_bytes(obj))
+
     def start_listening(self):
-        """Starts the listener task"""
+        """Starts the listener, relay, agent init and worker tasks"""
         self.listener_task = asyncio.create_task(self.listen())
+        self.relay_task = asyncio.create_task(self.relay())
+        self.init_task = asyncio.create_task(self._init_agent())
+        self.agent_worker_task = asyncio.create_task(self.agent_worker())
 
     def cleanup(self):
         """Cleans up resources for this connection"""
         if self.listener_task and not self.listener_task.done():
             self.listener_task.cancel()
-        logging.info("Cleaned up connection.")
+        if self.relay_task and not self.relay_task.done():
+            self.relay_task.cancel()
+        if self.init_task and not self.init_task.done():
+            self.init_task.cancel()
+        if self.agent_worker_task and not self.agent_worker_task.done():
+            self.agent_worker_task.cancel()
+        logger.info("Cleaned up connection.")
 
     async def handle_mcp_response(self, mcp_data: dict):
         """Handles MCP responses from the browser"""
         request_id = mcp_data.get("id")
-        if request_id in self.pending_mcp_requests:
-            future = self.pending_mcp_requests.pop(request_id)
+        future = self.pending_mcp_requests.pop(request_id, None)
+        if future is not None:
             if not future.done():
                 future.set_result(mcp_data)
         else:
-            logging.warning(f"Received response for unknown request ID: {request_id}")
+            logger.warning("Received response for unknown request ID: %s", request_id)
+
+    def _mcp_frame(self, method: str, request_id: int, params: Optional[Dict]) -> bytes:
+        """Builds a serialized MCP request from a cached per-method prefix"""
+        prefix = self._method_prefixes.get(method)
+        if prefix is None:
+            prefix = b'{"jsonrpc":"2.0","method":' + json_dump_bytes(method) + b',"id":'
+            self._method_prefixes[method] = prefix
+        frame = prefix + str(request_id).encode()
+        if params:
+            frame += b',"params":' + json_dump_bytes(params)
+        return frame + b"}"
 
     async def send_mcp_request(self, method: str, params: Optional[Dict] = None) -> Any:
         """Sends an MCP request and waits for the response"""
+        method = sys.intern(method)
+        # The semaphore bounds requests actually in flight; the waiter count
+        # catches an unresponsive browser piling up queued callers behind it
+        if self._inflight_waiters >= _MCP_BACKLOG_LIMIT:
+            raise RuntimeError("MCP request backlog exceeded; browser is not responding")
+        self._inflight_waiters += 1
+        try:
+            async with self._inflight:
+                return await self._do_mcp_request(method, params)
+        finally:
+            self._inflight_waiters -= 1
+
+    async def _do_mcp_request(self, method: str, params: Optional[Dict]) -> Any:
+        """Performs one MCP round trip once a semaphore permit is held"""
         self.mcp_request_id += 1
         request_id = self.mcp_request_id
-        
-        mcp_request = {
-            "jsonrpc": "2.0",
-            "method": method,
-            "id": request_id,
-        }
-        if params:
-            mcp_request["params"] = params
 
-        future = asyncio.Future()
+        # create_future() is cheaper than asyncio.Future() and picks up the
+        # loop's (C-accelerated) future implementation
+        future = asyncio.get_running_loop().create_future()
         self.pending_mcp_requests[request_id] = future
-        
+
         try:
-            await self.websocket.send_text(json.dumps(mcp_request))
-            response = await asyncio.wait_for(future, timeout=15.0)
-            return response
+            self.out_queue.put_nowait(self._mcp_frame(method, request_id, params))
+            async with asyncio.timeout(15.0):
+                return await future
         except asyncio.TimeoutError:
-            logging.error(f"Timeout waiting for MCP response for request ID {request_id}")
+            logger.error("Timeout waiting for MCP response for request ID %s", request_id)
             raise
         except Exception as e:
-            logging.error(f"Error during MCP request: {e}")
-            self.pending_mcp_requests.pop(request_id, None)
+            logger.error("Error during MCP request: %s", e)
             raise
+        finally:
+            # Drop the future on every exit so timeouts and cancellation
+            # cannot leak entries into pending_mcp_requests
+            self.pending_mcp_requests.pop(request_id, None)
+
+    def send_delta(self, delta: str, message_id: Optional[str]):
+        """Queues one incremental chunk of agent output"""
+        frame = {"delta": delta}
+        if message_id:
+            frame["messageId"] = message_id
+        self.send_json(frame)
+
+    def send_done(self, message_id: Optional[str]):
+        """Queues the end-of-stream marker for an agent response"""
+        frame = {"done": True}
+        if message_id:
+            frame["messageId"] = message_id
+        self.send_json(frame)
 
     async def process_agent_message(self, message: str, message_id: Optional[str]):
         """Processes a message with the agent"""
@@ -105,22 +276,36 @@ class ConnectionManager:
             response = {"error": "Agent not ready"}
             if message_id:
                 response["messageId"] = message_id
-            await self.websocket.send_text(json.dumps(response))
+            self.send_json(response)
+            return
+
+        cache_key = " ".join(message.lower().split())
+        if self.cache_responses and cache_key in self.response_cache:
+            self.send_delta(self.response_cache[cache_key], message_id)
+            self.send_done(message_id)
             return
 
         try:
-            result = await self.agent_executor.ainvoke({"input": message})
-            output = result.get("output", str(result))
-            response = {"result": output}
-            if message_id:
-                response["messageId"] = message_id
-            await self.websocket.send_text(json.dumps(response))
+            output_parts = []
+            async for event in self.agent_executor.astream_events({"input": message}, version="v2"):
+                if event["event"] != "on_chat_model_stream":
+                    continue
+                delta = chunk_text(event["data"]["chunk"])
+                if delta:
+                    output_parts.append(delta)
+                    self.send_delta(delta, message_id)
+            output = "".join(output_parts)
+            if self.cache_responses:
+                if len(self.response_cache) >= _RESPONSE_CACHE_MAX:
+                    self.response_cache.pop(next(iter(self.response_cache)))
+                self.response_cache[cache_key] = output
+            self.send_done(message_id)
         except Exception as e:
-            logging.error(f"Error during agent processing: {e}")
+            logger.error("Error during agent processing: %s", e)
             response = {"error": str(e)}
             if message_id:
                 response["messageId"] = message_id
-            await self.websocket.send_text(json.dumps(response))
+            self.send_json(response)
 
 class DynamicMCPTool(BaseTool):
     """Dynamic tool that represents an MCP tool from the browser"""
@@ -138,11 +323,13 @@ class DynamicMCPTool(BaseTool):
     async def _arun(self, **kwargs) -> str:
         """Call the MCP tool on the browser via the connection manager"""
         try:
-            from pydantic_core import to_jsonable_python
-            serializable_kwargs = to_jsonable_python(kwargs)
-            
+            if all(type(v) in _JSON_SCALAR_TYPES for v in kwargs.values()):
+                serializable_kwargs = kwargs
+            else:
+                serializable_kwargs = to_jsonable_python(kwargs)
+
             params = {"name": self.name, "arguments": serializable_kwargs}
-            response = await self.manager.send_mcp_request("tools/call", params)
+            response = await self.manager.send_mcp_request(_TOOLS_CALL, params)
             
             if "error" in response:
                 return f"Error calling {self.name}: {response['error']}"
@@ -155,28 +342,42 @@ class DynamicMCPTool(BaseTool):
 
 from jsonschema_pydantic import jsonschema_to_pydantic
 
+# Compiled Pydantic models per input schema, shared across connections so
+# reconnecting clients with identical tools skip the model synthesis
+_SCHEMA_CACHE: Dict[str, Any] = {}
+
+
+def _args_schema_for(tool_name: str, input_schema: dict):
+    """Returns a cached Pydantic model for the tool's input schema"""
+    key = json.dumps(input_schema, sort_keys=True)
+    args_schema = _SCHEMA_CACHE.get(key)
+    if args_schema is None:
+        try:
+            args_schema = jsonschema_to_pydantic(input_schema)
+        except Exception as e:
+            logger.error("Failed to create Pydantic model for %s: %s", tool_name, e)
+            return None
+        _SCHEMA_CACHE[key] = args_schema
+    return args_schema
+
 
 async def discover_and_create_tools(manager: ConnectionManager) -> list[BaseTool]:
     """Discover MCP tools from browser and create LangChain tools"""
     try:
-        response = await manager.send_mcp_request("tools/list")
+        response = await manager.send_mcp_request(_TOOLS_LIST)
         
         if "error" in response:
-            logging.error(f"Error getting tools: {response['error']}")
+            logger.error("Error getting tools: %s", response["error"])
             return []
         
         tools_data = response.get("result", {}).get("tools", [])
         
         tools = []
         for tool_info in tools_data:
-            tool_name = tool_info["name"]
+            tool_name = sys.intern(tool_info["name"])
             args_schema = None
             if "inputSchema" in tool_info:
-                try:
-                    args_schema = jsonschema_to_pydantic(tool_info["inputSchema"])
-                except Exception as e:
-                    logging.error(f"Failed to create Pydantic model for {tool_name}: {e}")
-                    args_schema = None
+                args_schema = _args_schema_for(tool_name, tool_info["inputSchema"])
 
             tool = DynamicMCPTool(
                 name=tool_name,
@@ -190,21 +391,63 @@ async def discover_and_create_tools(manager: ConnectionManager) -> list[BaseTool
         return tools
         
     except Exception as e:
-        logging.error(f"Error discovering tools: {e}")
+        logger.error("Error discovering tools: %s", e)
         return []
 
+@lru_cache(maxsize=1)
+def get_llm() -> ChatAnthropic:
+    """Shared Anthropic client so all connections reuse one HTTP pool"""
+    return ChatAnthropic(
+        model="claude-sonnet-4-20250514",
+        api_key=_ANTHROPIC_KEY,
+        default_headers={"anthropic-beta": "prompt-caching-2024-07-31"},
+    )
+
+
 async def create_agent_with_tools(tools: list[BaseTool]) -> AgentExecutor:
     """Create a new agent with the given tools"""
-    llm = ChatAnthropic(model="claude-sonnet-4-20250514", api_key=os.getenv("ANTHROPIC_API_KEY"))
+    llm = get_llm()
     prompt = ChatPromptTemplate.from_messages([
-        ("system", "You are a helpful form-filling assistant."),
+        SystemMessage(content=[{
+            "type": "text",
+            "text": "You are a helpful form-filling assistant.",
+            "cache_control": {"type": "ephemeral"},
+        }]),
         MessagesPlaceholder(variable_name="chat_history", optional=True),
         ("human", "{input}"),
         MessagesPlaceholder(variable_name="agent_scratchpad")
     ])
-    agent = create_tool_calling_agent(llm, tools, prompt)
+    # Bind tools in Anthropic's native format so the last entry can carry
+    # cache_control, making the whole tool-schema block one cached prefix
+    tool_specs = [
+        {
+            "name": tool.name,
+            "description": tool.description,
+            "input_schema": tool.tool_info.get("inputSchema", {"type": "object", "properties": {}}),
+        }
+        for tool in tools
+    ]
+    if tool_specs:
+        tool_specs[-1]["cache_control"] = {"type": "ephemeral"}
+    agent = create_tool_calling_agent(llm, tool_specs or tools, prompt)
     return AgentExecutor(agent=agent, tools=tools)
 
+# Connections without tools share one executor; building an agent per
+# no-tool connection would redo the prompt pipeline for nothing
+_no_tool_executor: Optional[AgentExecutor] = None
+_no_tool_lock = asyncio.Lock()
+
+
+async def get_no_tool_executor() -> AgentExecutor:
+    """Returns the shared executor for connections exposing no MCP tools"""
+    global _no_tool_executor
+    if _no_tool_executor is None:
+        async with _no_tool_lock:
+            if _no_tool_executor is None:
+                _no_tool_executor = await create_agent_with_tools([])
+    return _no_tool_executor
+
+
 app = FastAPI(title="Form Assistant Agent")
 
 @app.websocket("/chat")
@@ -212,25 +455,19 @@ async def websocket_chat(websocket: WebSocket):
     await websocket.accept()
     manager = ConnectionManager(websocket)
 
-    # Start listening for messages immediately
+    # Start listening immediately; tool discovery and agent construction
+    # run concurrently while early messages buffer in the inbound queue
     manager.start_listening()
-    
-    tools = await discover_and_create_tools(manager)
-    
-    if tools:
-        manager.agent_executor = await create_agent_with_tools(tools)
-    else:
-        manager.agent_executor = await create_agent_with_tools([])
 
     try:
         # Keep the connection alive by waiting on the listener task
         if manager.listener_task:
             await manager.listener_task
     except asyncio.CancelledError:
-        logging.info("WebSocket handler's listener task was cancelled.")
+        logger.info("WebSocket handler's listener task was cancelled.")
     finally:
         manager.cleanup()
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=8000, loop="uvloop", http="httptools", ws="websockets", ws_per_message_deflate=True)
\ No newline at end of file
@@ -128,6 +128,7 @@ class WizardDemo {
         this.ws = null;
         this.messageId = 0;
         this.pendingRequests = new Map();
+        this.streamBuffers = new Map();
         this.mcpServer = new MCPServer(this);
         this.setupWizardButton();
         this.connectToAgent();
@@ -136,7 +137,8 @@ class WizardDemo {
     connectToAgent() {
         try {
             this.ws = new WebSocket(this.agentUrl);
-            
+            this.ws.binaryType = 'arraybuffer';
+
             this.ws.onopen = () => {
                 console.log('Connected to agent via WebSocket');
                 this.showStatus('Connected to agent');
@@ -147,8 +149,16 @@ class WizardDemo {
             
             this.ws.onmessage = (event) => {
                 try {
-                    const data = JSON.parse(event.data);
-                    this.handleAgentResponse(data);
+                    // The agent sends binary frames; older servers send text
+                    const text = typeof event.data === 'string'
+                        ? event.data
+                        : new TextDecoder().decode(event.data);
+                    // The agent may merge bursts into one newline-delimited frame
+                    for (const line of text.split('\n')) {
+                        if (line) {
+                            this.handleAgentResponse(JSON.parse(line));
+                        }
+                    }
                 } catch (error) {
                     console.error('Error parsing agent response:', error);
                     this.showStatus('Error parsing agent response', true);
@@ -302,21 +312,33 @@ class WizardDemo {
         
         if (data.error) {
             console.error('Agent error:', data.error);
+            this.streamBuffers.delete(messageId);
+            this.pendingRequests.delete(messageId);
             this.showStatus('Agent error: ' + data.error, true);
             return;
         }
         
-        if (data.result) {
-            console.log('Agent response:', data.result);
+        if (data.delta) {
+            // Accumulate streamed chunks until the done frame arrives
+            const buffered = this.streamBuffers.get(messageId) || '';
+            this.streamBuffers.set(messageId, buffered + data.delta);
+            this.showStatus('Agent responding...');
+            return;
+        }
+
+        if (data.done || data.result) {
+            const fullText = data.result || this.streamBuffers.get(messageId) || '';
+            this.streamBuffers.delete(messageId);
+            console.log('Agent response:', fullText);
             this.showStatus('Agent response received');
-            
+
             const request = this.pendingRequests.get(messageId);
             if (request) {
                 this.showStatus('Agent processed request');
             }
-            
+
             this.pendingRequests.delete(messageId);
-            
+
             setTimeout(() => {
                 document.getElementById('wizardStatus').style.display = 'none';
             }, 3000);